@@ -1,16 +1,24 @@
 import os
+import re
+import json
+import hashlib
 import shutil
+import functools
+import itertools
+import multiprocessing
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 
 # --- LangChain & friends
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    PyMuPDFLoader,
-    PDFPlumberLoader,
-)
+# PDFPlumberLoader sengaja tidak di-import di sini: paling lambat dari semua
+# parser dan hanya dibutuhkan kalau fitz + pypdf sama-sama gagal (lihat _load_pdf_docs)
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from pypdf.errors import PdfReadError, PdfStreamError
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from google.api_core.exceptions import NotFound
 from langchain_google_genai import (
     GoogleGenerativeAIEmbeddings,
@@ -23,6 +31,16 @@ from langchain_core.runnables import RunnablePassthrough
 # --- Google GenAI SDK (untuk set api_version="v1")
 import google.generativeai as genai
 
+import faiss
+import numpy as np
+
+# langchain-community memperingatkan kombinasi MAX_INNER_PRODUCT + normalize_L2
+# padahal di sini memang disengaja (vektor unit → inner product == cosine);
+# redam supaya tiap build/reload index tidak mengulang warning yang sama
+warnings.filterwarnings(
+    "ignore", message="Normalizing L2 is not applicable for metric type"
+)
+
 # =========================
 # Konfigurasi dasar
 # =========================
@@ -55,16 +73,238 @@ _GEMINI_MODEL_CANDIDATES = [
 ]
 
 
+# FAISS index: HNSW (graf navigasi, search ~O(log N) dengan recall >99% untuk
+# k kecil) di atas kode scalar-quantized int8 — tetap 4x lebih hemat RAM
+# daripada FP32. text-embedding-004 menghasilkan vektor 768 dimensi.
+EMBED_DIM = 768
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 32
+IVF_NPROBE = 8  # hanya untuk index IVF lama yang belum di-rebuild
+
+
+# Embedding call dibatasi jaringan, bukan CPU: kirim batch 100 secara paralel
+EMBED_BATCH_SIZE = 100
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", 8))
+
+
+def embed_documents_batched(texts):
+    """Embed teks dalam batch paralel untuk menyembunyikan RTT API."""
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return embedding_model.embed_documents(texts)
+    with ThreadPoolExecutor(max_workers=min(EMBED_WORKERS, len(batches))) as ex:
+        results = list(ex.map(embedding_model.embed_documents, batches))
+    return list(itertools.chain.from_iterable(results))
+
+
+def build_vectorstore(splits):
+    """Buat vectorstore FAISS baru (HNSW+SQ8) dari dokumen hasil split."""
+    texts = [d.page_content for d in splits]
+    metadatas = [d.metadata for d in splits]
+    embs = embed_documents_batched(texts)
+    arr = np.ascontiguousarray(embs, dtype=np.float32)
+    # Normalisasi sekali di sini; dengan vektor unit, inner product == cosine
+    # dan tiap perbandingan hemat satu sqrt+sub dibanding L2
+    faiss.normalize_L2(arr)
+    # HNSW tidak butuh clustering; cukup training statistik quantizer SQ8,
+    # jadi jalur build sama untuk korpus kecil maupun besar
+    raw = faiss.IndexHNSWSQ(
+        EMBED_DIM, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+    )
+    raw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    raw.hnsw.efSearch = HNSW_EF_SEARCH
+    raw.train(arr)
+    vs = FAISS(
+        embedding_function=embedding_model,
+        index=raw,
+        docstore=InMemoryDocstore({}),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        normalize_L2=True,
+    )
+    # Embedding sudah dinormalisasi di atas; jangan embed ulang lewat add_documents
+    vs.add_embeddings(list(zip(texts, arr)), metadatas=metadatas)
+    return vs
+
+
 def load_faiss_or_none():
     index_path = os.path.join(DB_DIR)
     try:
-        return FAISS.load_local(index_path, embedding_model, allow_dangerous_deserialization=True)
+        vs = FAISS.load_local(
+            index_path,
+            embedding_model,
+            allow_dangerous_deserialization=True,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            normalize_L2=True,
+        )
     except Exception:
         return None
+    if hasattr(vs.index, "hnsw"):
+        vs.index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif hasattr(vs.index, "nprobe"):
+        vs.index.nprobe = IVF_NPROBE
+    return vs
+
+
+def _save_index_atomic(vs):
+    """Simpan index ke file sementara lalu os.replace ke nama final.
+
+    save_local biasa men-truncate index.faiss di tempat; server.py masih
+    memegang file itu via mmap, jadi search yang sedang jalan bisa kena
+    SIGBUS. os.replace atomik di POSIX — pembaca lama tetap melihat inode
+    lama, dan mtime baru muncul hanya setelah file sudah utuh.
+    """
+    vs.save_local(DB_DIR, index_name="index.tmp")
+    os.replace(os.path.join(DB_DIR, "index.tmp.faiss"), os.path.join(DB_DIR, "index.faiss"))
+    os.replace(os.path.join(DB_DIR, "index.tmp.pkl"), os.path.join(DB_DIR, "index.pkl"))
 
 
 vectorstore = load_faiss_or_none()
 
+
+@functools.lru_cache(maxsize=4096)
+def _embed_query_cached(question: str):
+    """Embed pertanyaan sekali saja; duplikat persis tidak perlu API call lagi."""
+    return tuple(embedding_model.embed_query(question))
+
+
+# Nama UMKM diekstrak sekali saat ingest dan disimpan; dipakai server.py
+# untuk menjawab pertanyaan "daftar UMKM" tanpa LLM
+UMKM_NAMES_PATH = os.path.join(DB_DIR, "umkm_names.json")
+# Dokumen naratif kadang menyebut "UMKM <Nama>" secara eksplisit
+_UMKM_NAME_RE = re.compile(r"UMKM\s+([A-Z][\w.]*(?:\s+[A-Z][\w.]*)*)")
+# Di katalog (DataUMKM.pdf) nama UMKM justru muncul sebagai judul polos —
+# baris pendek kapital ("Dapur Mermaid", "2Good2Go") yang langsung diikuti
+# baris bullet produk "● ..."
+_UMKM_HEADING_RE = re.compile(r"^[0-9A-Z][\w.&'-]*(?:\s+[0-9A-Z][\w.&'-]*){0,4}$")
+
+
+def _extract_umkm_names(text):
+    names = {m.strip() for m in _UMKM_NAME_RE.findall(text)}
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    for line, nxt in zip(lines, lines[1:]):
+        if nxt.startswith("●") and not line.startswith("●") and _UMKM_HEADING_RE.match(line):
+            names.add(line)
+    return names
+
+
+def _load_umkm_names():
+    try:
+        with open(UMKM_NAMES_PATH, "r") as f:
+            return set(json.load(f))
+    except Exception:
+        return set()
+
+
+def _update_umkm_names(splits):
+    names = _load_umkm_names()
+    for s in splits:
+        names.update(_extract_umkm_names(s.page_content))
+    try:
+        with open(UMKM_NAMES_PATH, "w") as f:
+            json.dump(sorted(names), f)
+    except Exception:
+        pass
+    return names
+
+
+
+# Chunk duplikat (menu yang berulang antar halaman / PDF yang diupload ulang)
+# hanya membengkakkan index; saring berdasarkan hash isi yang sudah dinormalisasi
+CHUNK_HASHES_PATH = os.path.join(DB_DIR, "hashes.json")
+
+
+def _dedupe_splits(splits):
+    """Buang chunk yang isinya sudah pernah masuk index; return (unik, set hash).
+
+    Set hash yang sudah diperbarui TIDAK ditulis di sini — pemanggil yang
+    mem-persist lewat _save_chunk_hashes SETELAH index tersimpan, supaya
+    ingest yang gagal di tengah jalan bisa diulang tanpa chunk-nya dianggap
+    sudah masuk.
+    """
+    try:
+        with open(CHUNK_HASHES_PATH, "r") as f:
+            seen = set(json.load(f))
+    except Exception:
+        seen = set()
+    unique = []
+    for s in splits:
+        h = hashlib.sha1(
+            re.sub(r"\s+", " ", s.page_content.strip().lower()).encode()
+        ).hexdigest()
+        if h in seen:
+            continue
+        seen.add(h)
+        unique.append(s)
+    return unique, seen
+
+
+def _save_chunk_hashes(seen):
+    try:
+        with open(CHUNK_HASHES_PATH, "w") as f:
+            json.dump(sorted(seen), f)
+    except Exception:
+        pass
+
+
+def _load_pdf_docs(pdf_path):
+    """Baca PDF per halaman; kembalikan (docs, error per parser).
+
+    PyMuPDF (fitz) menangani mayoritas PDF dan paling cepat, jadi dicoba
+    duluan — langsung lewat fitz tanpa wrapper LangChain supaya tidak ada
+    pass pembangunan metadata ekstra per halaman. Parser lain hanya dicoba
+    (dan di-import) kalau fitz gagal.
+    """
+    loader_errors = []
+    try:
+        import fitz
+        with fitz.open(pdf_path) as pdf:
+            docs = [
+                Document(
+                    page_content=page.get_text(),
+                    metadata={"source": pdf_path, "page": page.number},
+                )
+                for page in pdf
+            ]
+        if docs:
+            return docs, loader_errors
+        loader_errors.append("fitz: empty document")
+    except Exception as e:
+        loader_errors.append(f"fitz: {e}")
+
+    try:
+        docs = PyPDFLoader(pdf_path).load()
+        if docs:
+            return docs, loader_errors
+        loader_errors.append("PyPDFLoader: empty document")
+    except Exception as e:
+        loader_errors.append(f"PyPDFLoader: {e}")
+
+    try:
+        from langchain_community.document_loaders import PDFPlumberLoader
+        docs = PDFPlumberLoader(pdf_path).load()
+        if docs:
+            return docs, loader_errors
+        loader_errors.append("PDFPlumberLoader: empty document")
+    except Exception as e:
+        loader_errors.append(f"PDFPlumberLoader: {e}")
+
+    return None, loader_errors
+
+
+def split_documents_parallel(splitter, docs):
+    """Split per halaman lewat process pool; sequential untuk PDF kecil."""
+    if len(docs) < 8:
+        return splitter.split_documents(docs)
+    workers = int(os.environ.get("LOAD_THREADS", max(1, (os.cpu_count() or 2) - 1)))
+    # "fork" di Linux: splitter ikut ter-copy ke worker tanpa biaya pickling besar
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    with ctx.Pool(workers) as pool:
+        per_page = pool.map(splitter.split_documents, [[d] for d in docs])
+    return list(itertools.chain.from_iterable(per_page))
+
+
 # =========================
 # RAG chain
 # =========================
@@ -97,7 +337,8 @@ rag_prompt = ChatPromptTemplate.from_template(RAG_TEMPLATE)
 
 def format_docs(docs):
     """Gabungkan isi dokumen jadi satu teks utuh"""
-    return "\n\n".join(doc.page_content for doc in docs)
+    # List comprehension (bukan generator) supaya join bisa pre-size buffer-nya
+    return "\n\n".join([doc.page_content for doc in docs])
 
 
 chain = (
@@ -141,20 +382,8 @@ if mode == "Admin":
             st.stop()
 
         st.info("📚 Memproses dokumen...")
-        # Coba beberapa loader agar kompatibel dengan lebih banyak variasi PDF
-        docs = None
-        loader_errors = []
-        for LoaderCls in (PyPDFLoader, PyMuPDFLoader, PDFPlumberLoader):
-            try:
-                loader = LoaderCls(pdf_path)
-                docs = loader.load()
-                break
-            except (PdfReadError, PdfStreamError) as e:
-                loader_errors.append(f"{LoaderCls.__name__}: {e}")
-                continue
-            except Exception as e:
-                loader_errors.append(f"{LoaderCls.__name__}: {e}")
-                continue
+        # Coba beberapa parser agar kompatibel dengan lebih banyak variasi PDF
+        docs, loader_errors = _load_pdf_docs(pdf_path)
         if not docs:
             st.error(
                 "Tidak bisa membaca PDF ini dengan beberapa parser. Pastikan file tidak terenkripsi/scan-only. "
@@ -168,14 +397,24 @@ if mode == "Admin":
             st.stop()
 
         splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-        splits = splitter.split_documents(docs)
+        splits, chunk_hashes = _dedupe_splits(split_documents_parallel(splitter, docs))
+        if not splits:
+            st.info("Semua isi dokumen sudah ada di index — tidak ada chunk baru.")
+            st.stop()
+        _update_umkm_names(splits)
 
         # Init or append to FAISS index, then persist
         if vectorstore is None:
-            vectorstore = FAISS.from_documents(splits, embedding_model)
+            vectorstore = build_vectorstore(splits)
         else:
-            vectorstore.add_documents(splits)
-        vectorstore.save_local(DB_DIR)
+            texts = [d.page_content for d in splits]
+            embs = embed_documents_batched(texts)
+            vectorstore.add_embeddings(
+                list(zip(texts, embs)), metadatas=[d.metadata for d in splits]
+            )
+        _save_index_atomic(vectorstore)
+        # Index sudah tersimpan → baru sekarang hash chunk boleh di-persist
+        _save_chunk_hashes(chunk_hashes)
         st.success("✅ Dokumen berhasil disimpan dan siap digunakan!")
 
 else:
@@ -188,11 +427,11 @@ else:
             if local_vs is None:
                 st.warning("Database belum ada. Masuk ke mode Admin untuk mengunggah dokumen dulu.")
                 st.stop()
-            docs = local_vs.similarity_search(query, k=8)
+            q_emb = list(_embed_query_cached(query))
+            docs = local_vs.similarity_search_by_vector(q_emb, k=8)
             if not docs:
                 st.warning("Tidak ada informasi relevan dalam database.")
             else:
-                import json
                 try:
                     raw = chain.invoke({"context": docs, "question": query})
                 except NotFound:
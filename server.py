@@ -1,32 +1,50 @@
 import os
-import shutil
+import re
 import json
+import hashlib
+import time
+import pickle
+import asyncio
+import threading
+import warnings
+import functools
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+import orjson
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # LangChain & related
-from langchain_community.document_loaders import (
-	PyPDFLoader,
-	PyMuPDFLoader,
-	PDFPlumberLoader,
-)
+# PDFPlumberLoader sengaja tidak di-import di sini: paling lambat dari semua
+# parser dan hanya dibutuhkan kalau fitz + pypdf sama-sama gagal (lihat _load_pdf_docs)
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from pypdf.errors import PdfReadError, PdfStreamError
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from google.api_core.exceptions import NotFound
 from langchain_google_genai import (
 	GoogleGenerativeAIEmbeddings,
 	ChatGoogleGenerativeAI,
 )
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-
 import google.generativeai as genai
 
+import faiss
+import numpy as np
+
+# langchain-community memperingatkan kombinasi MAX_INNER_PRODUCT + normalize_L2
+# padahal di sini memang disengaja (vektor unit → inner product == cosine);
+# redam supaya tiap build/reload index tidak mengulang warning yang sama
+warnings.filterwarnings(
+	"ignore", message="Normalizing L2 is not applicable for metric type"
+)
+
 
 # =========================
 # Directories & Config
@@ -57,21 +75,314 @@ _GEMINI_MODEL_CANDIDATES = [
 ]
 
 
+# FAISS index: HNSW (graf navigasi, search ~O(log N) dengan recall >99% untuk
+# k kecil) di atas kode scalar-quantized int8 — tetap 4x lebih hemat RAM
+# daripada FP32. text-embedding-004 menghasilkan vektor 768 dimensi.
+EMBED_DIM = 768
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 32
+IVF_NPROBE = 8  # hanya untuk index IVF lama yang belum di-rebuild
+
+
+# Embedding call dibatasi jaringan, bukan CPU: kirim batch 100 secara paralel
+EMBED_BATCH_SIZE = 100
+EMBED_WORKERS = int(os.environ.get("EMBED_WORKERS", 8))
+
+
+def embed_documents_batched(texts):
+	"""Embed teks dalam batch paralel untuk menyembunyikan RTT API."""
+	batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+	if len(batches) <= 1:
+		return embedding_model.embed_documents(texts)
+	with ThreadPoolExecutor(max_workers=min(EMBED_WORKERS, len(batches))) as ex:
+		results = list(ex.map(embedding_model.embed_documents, batches))
+	return list(itertools.chain.from_iterable(results))
+
+
+def build_vectorstore(splits):
+	"""Buat vectorstore FAISS baru (HNSW+SQ8) dari dokumen hasil split."""
+	texts = [d.page_content for d in splits]
+	metadatas = [d.metadata for d in splits]
+	embs = embed_documents_batched(texts)
+	arr = np.ascontiguousarray(embs, dtype=np.float32)
+	# Normalisasi sekali di sini; dengan vektor unit, inner product == cosine
+	# dan tiap perbandingan hemat satu sqrt+sub dibanding L2
+	faiss.normalize_L2(arr)
+	# HNSW tidak butuh clustering; cukup training statistik quantizer SQ8,
+	# jadi jalur build sama untuk korpus kecil maupun besar
+	raw = faiss.IndexHNSWSQ(
+		EMBED_DIM, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+	)
+	raw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+	raw.hnsw.efSearch = HNSW_EF_SEARCH
+	raw.train(arr)
+	vs = FAISS(
+		embedding_function=embedding_model,
+		index=raw,
+		docstore=InMemoryDocstore({}),
+		index_to_docstore_id={},
+		distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+		normalize_L2=True,
+	)
+	# Embedding sudah dinormalisasi di atas; jangan embed ulang lewat add_documents
+	vs.add_embeddings(list(zip(texts, arr)), metadatas=metadatas)
+	return vs
+
+
 def load_faiss_or_none():
 	index_path = os.path.join(DB_DIR)
 	try:
-		return FAISS.load_local(index_path, embedding_model, allow_dangerous_deserialization=True)
+		vs = FAISS.load_local(
+			index_path,
+			embedding_model,
+			allow_dangerous_deserialization=True,
+			distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+			normalize_L2=True,
+		)
 	except Exception:
 		return None
+	if hasattr(vs.index, "hnsw"):
+		vs.index.hnsw.efSearch = HNSW_EF_SEARCH
+	elif hasattr(vs.index, "nprobe"):
+		vs.index.nprobe = IVF_NPROBE
+	return vs
+
+
+INDEX_FAISS_PATH = os.path.join(DB_DIR, "index.faiss")
+INDEX_PKL_PATH = os.path.join(DB_DIR, "index.pkl")
+
+_VS_LOCK = threading.RLock()
+_VS_CACHE = {"mtime": None, "vs": None}
+
+
+def _load_faiss_mmap():
+	"""Load index via mmap read-only supaya page cache OS yang melayaninya."""
+	index = faiss.read_index(INDEX_FAISS_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+	if hasattr(index, "hnsw"):
+		index.hnsw.efSearch = HNSW_EF_SEARCH
+	elif hasattr(index, "nprobe"):
+		index.nprobe = IVF_NPROBE
+	# Format yang sama dengan yang ditulis save_local (lihat allow_dangerous_deserialization)
+	with open(INDEX_PKL_PATH, "rb") as f:
+		docstore, index_to_docstore_id = pickle.load(f)
+	return FAISS(
+		embedding_function=embedding_model,
+		index=index,
+		docstore=docstore,
+		index_to_docstore_id=index_to_docstore_id,
+		distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+		normalize_L2=True,
+	)
+
+
+def get_vectorstore():
+	"""Vectorstore ter-cache di module level; reload hanya saat file index berubah."""
+	try:
+		mtime = os.path.getmtime(INDEX_FAISS_PATH)
+	except OSError:
+		return None
+	with _VS_LOCK:
+		if _VS_CACHE["vs"] is None or _VS_CACHE["mtime"] != mtime:
+			try:
+				_VS_CACHE["vs"] = _load_faiss_mmap()
+			except Exception:
+				_VS_CACHE["vs"] = load_faiss_or_none()
+			_VS_CACHE["mtime"] = mtime
+		return _VS_CACHE["vs"]
+
+
+def _save_index_atomic(vs):
+	"""Simpan index ke file sementara lalu os.replace ke nama final.
+
+	save_local biasa men-truncate index.faiss di tempat; proses serving masih
+	memegang file itu via mmap, jadi search yang sedang jalan bisa kena SIGBUS.
+	os.replace atomik di POSIX — pembaca lama tetap melihat inode lama, dan
+	mtime baru muncul hanya setelah file sudah utuh.
+	"""
+	vs.save_local(DB_DIR, index_name="index.tmp")
+	os.replace(os.path.join(DB_DIR, "index.tmp.faiss"), INDEX_FAISS_PATH)
+	os.replace(os.path.join(DB_DIR, "index.tmp.pkl"), INDEX_PKL_PATH)
 
 
 vectorstore = load_faiss_or_none()
 
 
+# =========================
+# Semantic cache untuk /chat
+# =========================
+# Pertanyaan yang mirip (parafrase) tidak perlu bayar round-trip Gemini lagi:
+# embedding pertanyaan dicocokkan ke cache kecil in-memory (IndexFlatIP, cosine
+# setelah normalisasi) dan jawaban JSON yang tersimpan dikembalikan langsung.
+CACHE_INDEX_PATH = os.path.join(DB_DIR, "cache.index")
+CACHE_META_PATH = os.path.join(DB_DIR, "cache_meta.json")
+CACHE_SIM_THRESHOLD = 0.92
+CACHE_TTL_SECONDS = int(os.environ.get("SEMANTIC_CACHE_TTL", 3600))
+CACHE_MAX_ENTRIES = 2048
+CACHE_PERSIST_EVERY = 32  # tulis ke disk tiap N insert, bukan tiap miss
+
+_cache_lock = threading.Lock()
+_cache_index = faiss.IndexFlatIP(EMBED_DIM)
+_cache_answers = []  # jawaban (dict) per entri, paralel dengan _cache_index
+_cache_times = []    # timestamp insert per entri, untuk TTL
+
+
+def _normalize_embedding(q_emb):
+	arr = np.ascontiguousarray([q_emb], dtype=np.float32)
+	faiss.normalize_L2(arr)
+	return arr
+
+
+def _load_semantic_cache():
+	global _cache_index, _cache_answers, _cache_times
+	try:
+		if os.path.exists(CACHE_INDEX_PATH) and os.path.exists(CACHE_META_PATH):
+			idx = faiss.read_index(CACHE_INDEX_PATH)
+			with open(CACHE_META_PATH, "rb") as f:
+				meta = orjson.loads(f.read())
+			answers = meta.get("answers", [])
+			times = meta.get("times", [])
+			if idx.ntotal == len(answers) == len(times):
+				_cache_index = idx
+				_cache_answers = answers
+				_cache_times = times
+	except Exception:
+		pass
+
+
+def _save_semantic_cache(index, answers, times):
+	try:
+		faiss.write_index(index, CACHE_INDEX_PATH)
+		with open(CACHE_META_PATH, "wb") as f:
+			f.write(orjson.dumps({"answers": answers, "times": times}))
+	except Exception:
+		pass
+
+
+def _compact_semantic_cache():
+	"""Buang entri kedaluwarsa/berlebih. Panggil dengan _cache_lock dipegang."""
+	global _cache_index, _cache_answers, _cache_times
+	now = time.time()
+	keep = [i for i, t in enumerate(_cache_times) if now - t <= CACHE_TTL_SECONDS]
+	keep = keep[-CACHE_MAX_ENTRIES:]
+	new_index = faiss.IndexFlatIP(EMBED_DIM)
+	if keep:
+		vectors = _cache_index.reconstruct_n(0, _cache_index.ntotal)
+		new_index.add(np.ascontiguousarray(vectors[keep]))
+	_cache_index = new_index
+	_cache_answers = [_cache_answers[i] for i in keep]
+	_cache_times = [_cache_times[i] for i in keep]
+
+
+def semantic_cache_lookup(q_emb):
+	"""Kembalikan jawaban ter-cache bila ada pertanyaan mirip, selain itu None."""
+	with _cache_lock:
+		if _cache_index.ntotal == 0:
+			return None
+		scores, ids = _cache_index.search(_normalize_embedding(q_emb), 1)
+		i = int(ids[0][0])
+		if i < 0 or float(scores[0][0]) < CACHE_SIM_THRESHOLD:
+			return None
+		if time.time() - _cache_times[i] > CACHE_TTL_SECONDS:
+			return None
+		return _cache_answers[i]
+
+
+_cache_inserts_since_save = 0
+
+
+def semantic_cache_store(q_emb, data):
+	global _cache_inserts_since_save
+	snapshot = None
+	with _cache_lock:
+		_cache_index.add(_normalize_embedding(q_emb))
+		_cache_answers.append(data)
+		_cache_times.append(time.time())
+		compacted = len(_cache_answers) > CACHE_MAX_ENTRIES
+		if compacted:
+			_compact_semantic_cache()
+		_cache_inserts_since_save += 1
+		if compacted or _cache_inserts_since_save >= CACHE_PERSIST_EVERY:
+			_cache_inserts_since_save = 0
+			# Snapshot di bawah lock; tulis ke disk DI LUAR lock supaya
+			# lookup di hot path tidak pernah menunggu I/O
+			snapshot = (
+				faiss.clone_index(_cache_index),
+				list(_cache_answers),
+				list(_cache_times),
+			)
+	if snapshot is not None:
+		_save_semantic_cache(*snapshot)
+
+
+_load_semantic_cache()
+
+
+@functools.lru_cache(maxsize=4096)
+def _embed_query_cached(question: str):
+	"""Embed pertanyaan sekali saja; duplikat persis tidak perlu API call lagi."""
+	return tuple(embedding_model.embed_query(question))
+
+
+# Pertanyaan "daftar UMKM" tidak butuh LLM: nama-nama UMKM diekstrak sekali
+# saat ingest dan disimpan, lalu /chat menjawabnya langsung dari file ini
+UMKM_NAMES_PATH = os.path.join(DB_DIR, "umkm_names.json")
+# Dokumen naratif kadang menyebut "UMKM <Nama>" secara eksplisit
+_UMKM_NAME_RE = re.compile(r"UMKM\s+([A-Z][\w.]*(?:\s+[A-Z][\w.]*)*)")
+# Di katalog (DataUMKM.pdf) nama UMKM justru muncul sebagai judul polos —
+# baris pendek kapital ("Dapur Mermaid", "2Good2Go") yang langsung diikuti
+# baris bullet produk "● ..."
+_UMKM_HEADING_RE = re.compile(r"^[0-9A-Z][\w.&'-]*(?:\s+[0-9A-Z][\w.&'-]*){0,4}$")
+_LIST_UMKM_RE = re.compile(r"daftar umkm|umkm yang|list umkm")
+
+
+def _extract_umkm_names(text):
+	names = {m.strip() for m in _UMKM_NAME_RE.findall(text)}
+	lines = [l.strip() for l in text.splitlines() if l.strip()]
+	for line, nxt in zip(lines, lines[1:]):
+		if nxt.startswith("●") and not line.startswith("●") and _UMKM_HEADING_RE.match(line):
+			names.add(line)
+	return names
+
+
+def _load_umkm_names():
+	try:
+		with open(UMKM_NAMES_PATH, "r") as f:
+			return set(json.load(f))
+	except Exception:
+		return set()
+
+
+def _update_umkm_names(splits):
+	names = _load_umkm_names()
+	for s in splits:
+		names.update(_extract_umkm_names(s.page_content))
+	try:
+		with open(UMKM_NAMES_PATH, "w") as f:
+			json.dump(sorted(names), f)
+	except Exception:
+		pass
+	return names
+
+
+def split_documents_parallel(splitter, docs):
+	"""Split per halaman lewat process pool; sequential untuk PDF kecil."""
+	if len(docs) < 8:
+		return splitter.split_documents(docs)
+	workers = int(os.environ.get("LOAD_THREADS", max(1, (os.cpu_count() or 2) - 1)))
+	# "fork" di Linux: splitter ikut ter-copy ke worker tanpa biaya pickling besar
+	ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+	with ctx.Pool(workers) as pool:
+		per_page = pool.map(splitter.split_documents, [[d] for d in docs])
+	return list(itertools.chain.from_iterable(per_page))
+
+
 # =========================
 # RAG chain
 # =========================
-RAG_TEMPLATE = """
+# Bagian statis (instruksi + aturan) dipisah dari bagian per-query supaya bisa
+# di-cache di sisi Gemini lewat context caching — lihat _refresh_context_cache
+RAG_STATIC = """
 You are a helpful assistant for an UMKM catalog (small businesses and their menus/products).
 
 Always do two things:
@@ -80,7 +391,7 @@ Always do two things:
    - recommend : user asks for recommendations / saran menu atau tempat
    - qa        : other questions
 2) Produce a JSON object with this shape (and nothing else):
-{{"intent":"list_umkm|recommend|qa","answer":"string","umkm_list":["<UMKM name>"],"recommendations":[{{"umkm":"<UMKM>","menu":"<menu/item>","reason":"short why"}}]}}
+{"intent":"list_umkm|recommend|qa","answer":"string","umkm_list":["<UMKM name>"],"recommendations":[{"umkm":"<UMKM>","menu":"<menu/item>","reason":"short why"}]}
 
 Rules:
 - Use ONLY the provided <context> to extract UMKM names and menus; if unsure, leave arrays empty and say you don't know.
@@ -88,32 +399,90 @@ Rules:
 - For intent = list_umkm: fill umkm_list with UNIQUE names you find.
 - For intent = qa: keep umkm_list empty unless explicitly asked; you may still cite UMKM in the natural-language answer if relevant.
 - Keep JSON valid and minified.
+"""
 
-<context>
-{context}
-</context>
 
-Question: {question}
-"""
-rag_prompt = ChatPromptTemplate.from_template(RAG_TEMPLATE)
+def _build_query_part(context: str, question: str) -> str:
+	return f"<context>\n{context}\n</context>\n\nQuestion: {question}"
 
 
 def format_docs(docs):
-	return "\n\n".join(doc.page_content for doc in docs)
+	# List comprehension (bukan generator) supaya join bisa pre-size buffer-nya
+	return "\n\n".join([doc.page_content for doc in docs])
 
 
-chain = (
-	RunnablePassthrough.assign(context=lambda x: format_docs(x["context"]))
-	| rag_prompt
-	| chat_model
-	| StrOutputParser()
-)
+# Model di-memo per nama dan dipanggil langsung — tanpa pipeline LCEL
+# (prompt | model | parser) yang menambah alokasi runnable + dict copy per
+# request
+_MODEL_CACHE = {_gemini_model: chat_model}
+_MODEL_LOCK = threading.Lock()
+
+
+def _get_chat_model(model_name: str):
+	with _MODEL_LOCK:
+		cached = _MODEL_CACHE.get(model_name)
+		if cached is None:
+			cached = ChatGoogleGenerativeAI(model=model_name)
+			_MODEL_CACHE[model_name] = cached
+		return cached
+
+
+# =========================
+# Gemini context caching (CAG)
+# =========================
+# Instruksi statis (~500 token) + daftar nama UMKM di-upload sekali sebagai
+# cached_content; per query tinggal bayar token snippet hasil retrieval.
+# Best-effort: tidak semua model/akun mendukung caching — jalur prompt penuh
+# tetap jadi fallback.
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", 3600))
+
+_context_cache_lock = threading.Lock()
+_context_cache = {"model": None}
+
+
+def _refresh_context_cache():
+	if not API_KEY:
+		return
+	try:
+		corpus = "\n".join(sorted(_load_umkm_names())) or "(belum ada data UMKM)"
+		cached = genai.caching.CachedContent.create(
+			model=_gemini_model,
+			system_instruction=RAG_STATIC,
+			contents=[corpus],
+			ttl=CONTEXT_CACHE_TTL_SECONDS,
+		)
+		model = genai.GenerativeModel.from_cached_content(cached_content=cached)
+		with _context_cache_lock:
+			_context_cache["model"] = model
+	except Exception:
+		with _context_cache_lock:
+			_context_cache["model"] = None
+
+
+def _invoke_via_context_cache(context: str, question: str):
+	"""Coba jalur cached_content; None bila cache tidak ada/kedaluwarsa."""
+	with _context_cache_lock:
+		model = _context_cache["model"]
+	if model is None:
+		return None
+	try:
+		resp = model.generate_content(_build_query_part(context, question))
+		return resp.text
+	except Exception:
+		# Cache kedaluwarsa atau ditolak; request ini jatuh ke prompt penuh
+		with _context_cache_lock:
+			_context_cache["model"] = None
+		return None
+
+
+threading.Thread(target=_refresh_context_cache, daemon=True).start()
 
 
 # =========================
 # FastAPI app
 # =========================
-app = FastAPI(title="UMKM AI API", version="1.0.0")
+# ORJSONResponse: serialisasi respons pakai orjson (SIMD) alih-alih encoder default
+app = FastAPI(title="UMKM AI API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS (adjust origins for your Laravel host)
 app.add_middleware(
@@ -136,7 +505,7 @@ def health():
 
 @app.get("/admin/status")
 def admin_status():
-	local_vs = load_faiss_or_none()
+	local_vs = get_vectorstore()
 	if local_vs is None:
 		return {
 			"index": "missing", 
@@ -166,25 +535,142 @@ def admin_status():
 	}
 
 
+
+# Chunk duplikat (menu yang berulang antar halaman / PDF yang diupload ulang)
+# hanya membengkakkan index; saring berdasarkan hash isi yang sudah dinormalisasi
+CHUNK_HASHES_PATH = os.path.join(DB_DIR, "hashes.json")
+
+
+def _dedupe_splits(splits):
+	"""Buang chunk yang isinya sudah pernah masuk index; return (unik, set hash).
+
+	Set hash yang sudah diperbarui TIDAK ditulis di sini — pemanggil yang
+	mem-persist lewat _save_chunk_hashes SETELAH index tersimpan, supaya
+	ingest yang gagal di tengah jalan bisa diulang tanpa chunk-nya dianggap
+	sudah masuk.
+	"""
+	try:
+		with open(CHUNK_HASHES_PATH, "r") as f:
+			seen = set(json.load(f))
+	except Exception:
+		seen = set()
+	unique = []
+	for s in splits:
+		h = hashlib.sha1(
+			re.sub(r"\s+", " ", s.page_content.strip().lower()).encode()
+		).hexdigest()
+		if h in seen:
+			continue
+		seen.add(h)
+		unique.append(s)
+	return unique, seen
+
+
+def _save_chunk_hashes(seen):
+	try:
+		with open(CHUNK_HASHES_PATH, "w") as f:
+			json.dump(sorted(seen), f)
+	except Exception:
+		pass
+
+
+def _load_pdf_docs(pdf_path):
+	"""Baca PDF per halaman; kembalikan (docs, error per parser).
+
+	PyMuPDF (fitz) menangani mayoritas PDF dan paling cepat, jadi dicoba
+	duluan — langsung lewat fitz tanpa wrapper LangChain supaya tidak ada
+	pass pembangunan metadata ekstra per halaman. Parser lain hanya dicoba
+	(dan di-import) kalau fitz gagal.
+	"""
+	loader_errors = []
+	try:
+		import fitz
+		with fitz.open(pdf_path) as pdf:
+			docs = [
+				Document(
+					page_content=page.get_text(),
+					metadata={"source": pdf_path, "page": page.number},
+				)
+				for page in pdf
+			]
+		if docs:
+			return docs, loader_errors
+		loader_errors.append("fitz: empty document")
+	except Exception as e:
+		loader_errors.append(f"fitz: {e}")
+
+	try:
+		docs = PyPDFLoader(pdf_path).load()
+		if docs:
+			return docs, loader_errors
+		loader_errors.append("PyPDFLoader: empty document")
+	except Exception as e:
+		loader_errors.append(f"PyPDFLoader: {e}")
+
+	try:
+		from langchain_community.document_loaders import PDFPlumberLoader
+		docs = PDFPlumberLoader(pdf_path).load()
+		if docs:
+			return docs, loader_errors
+		loader_errors.append("PDFPlumberLoader: empty document")
+	except Exception as e:
+		loader_errors.append(f"PDFPlumberLoader: {e}")
+
+	return None, loader_errors
+
+
+def _ingest_docs(docs):
+	"""Split + embed + simpan ke index; kembalikan jumlah chunk yang masuk."""
+	global vectorstore
+	splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
+	splits, chunk_hashes = _dedupe_splits(split_documents_parallel(splitter, docs))
+	if not splits:
+		return 0
+	_update_umkm_names(splits)
+
+	if vectorstore is None:
+		vectorstore = build_vectorstore(splits)
+	else:
+		texts = [d.page_content for d in splits]
+		embs = embed_documents_batched(texts)
+		vectorstore.add_embeddings(
+			list(zip(texts, embs)), metadatas=[d.metadata for d in splits]
+		)
+	_save_index_atomic(vectorstore)
+	# Index sudah tersimpan → baru sekarang hash chunk boleh di-persist
+	_save_chunk_hashes(chunk_hashes)
+	# Publikasikan langsung ke cache yang dipakai /chat — tanpa menunggu
+	# reload mtime, dan kebal granularity mtime kalau dua upload jatuh di
+	# detik yang sama
+	with _VS_LOCK:
+		_VS_CACHE["vs"] = vectorstore
+		try:
+			_VS_CACHE["mtime"] = os.path.getmtime(INDEX_FAISS_PATH)
+		except OSError:
+			_VS_CACHE["mtime"] = None
+	# Daftar UMKM berubah → refresh cached_content di sisi Gemini
+	_refresh_context_cache()
+	return len(splits)
+
+
 @app.post("/admin/upload")
 async def admin_upload(file: UploadFile = File(...)):
-	global vectorstore
 	if not file.filename.lower().endswith(".pdf"):
 		raise HTTPException(status_code=400, detail="Only PDF is supported")
 
-	pdf_path = os.path.join(UPLOAD_DIR, file.filename)
-	with open(pdf_path, "wb") as f:
-		shutil.copyfileobj(file.file, f)
+	# Validasi magic %PDF- dari 5 byte pertama SEBELUM menulis apa pun ke disk,
+	# supaya upload yang bukan PDF ditolak dengan biaya O(1)
+	head = await file.read(5)
+	if not head.startswith(b"%PDF-"):
+		raise HTTPException(status_code=400, detail="Invalid PDF file")
 
-	# Validate simple PDF header
+	pdf_path = os.path.join(UPLOAD_DIR, file.filename)
 	try:
-		with open(pdf_path, "rb") as f:
-			header = f.read(5)
-		if not header.startswith(b"%PDF-"):
-			os.remove(pdf_path)
-			raise HTTPException(status_code=400, detail="Invalid PDF file")
-	except HTTPException:
-		raise
+		with open(pdf_path, "wb") as f:
+			await asyncio.to_thread(f.write, head)
+			# Stream per 1MB: lebih sedikit syscall daripada copyfileobj default
+			while chunk := await file.read(1 << 20):
+				await asyncio.to_thread(f.write, chunk)
 	except Exception:
 		try:
 			os.remove(pdf_path)
@@ -192,20 +678,9 @@ async def admin_upload(file: UploadFile = File(...)):
 			pass
 		raise HTTPException(status_code=400, detail="Failed to read uploaded file")
 
-	# Try multiple loaders for compatibility
-	docs = None
-	loader_errors = []
-	for LoaderCls in (PyPDFLoader, PyMuPDFLoader, PDFPlumberLoader):
-		try:
-			loader = LoaderCls(pdf_path)
-			docs = loader.load()
-			break
-		except (PdfReadError, PdfStreamError) as e:
-			loader_errors.append(f"{LoaderCls.__name__}: {e}")
-			continue
-		except Exception as e:
-			loader_errors.append(f"{LoaderCls.__name__}: {e}")
-			continue
+	# Load + split + embed blocking semua; jalankan di worker thread supaya
+	# event loop tetap bisa melayani request lain
+	docs, loader_errors = await asyncio.to_thread(_load_pdf_docs, pdf_path)
 
 	if not docs:
 		try:
@@ -214,44 +689,127 @@ async def admin_upload(file: UploadFile = File(...)):
 			pass
 		raise HTTPException(status_code=400, detail="Cannot read this PDF with available parsers")
 
-	splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-	splits = splitter.split_documents(docs)
+	added_chunks = await asyncio.to_thread(_ingest_docs, docs)
+	return {"status": "ok", "added_chunks": added_chunks}
 
-	if vectorstore is None:
-		vectorstore = FAISS.from_documents(splits, embedding_model)
-	else:
-		vectorstore.add_documents(splits)
-	vectorstore.save_local(DB_DIR)
 
-	return {"status": "ok", "added_chunks": len(splits)}
+def _invoke_chain_with_fallback(context: str, question: str) -> Optional[dict]:
+	# Jalur murah dulu: prompt statis sudah ter-cache di sisi Gemini
+	raw = _invoke_via_context_cache(context, question)
+	if raw is not None:
+		return _parse_llm_output(raw)
 
+	prompt_text = RAG_STATIC + "\n" + _build_query_part(context, question)
+	for m in list(_GEMINI_MODEL_CANDIDATES):
+		try:
+			raw = _get_chat_model(m).invoke(prompt_text).content
+		except NotFound:
+			continue
+		if m != _GEMINI_MODEL_CANDIDATES[0]:
+			# Promosikan model yang berhasil supaya request berikutnya langsung ke sana
+			_GEMINI_MODEL_CANDIDATES.remove(m)
+			_GEMINI_MODEL_CANDIDATES.insert(0, m)
+			os.environ["GEMINI_MODEL"] = m
+		break
+
+	return _parse_llm_output(raw)
+
+
+def _invoke_chain_batched(items):
+	"""Jawab beberapa (context, question) sekaligus dalam SATU call Gemini.
+
+	Semua request memakai instruksi statis yang sama, jadi RTT + prefill bisa
+	diamortisasi satu batch. Kalau output batch gagal diparse, tiap item
+	diulang lewat jalur per-request biasa.
+	"""
+	if len(items) == 1:
+		context, question = items[0]
+		return [_invoke_chain_with_fallback(context, question)]
+
+	parts = [
+		f"### Request {i}\n{_build_query_part(context, question)}"
+		for i, (context, question) in enumerate(items, 1)
+	]
+	batch_prompt = (
+		RAG_STATIC
+		+ "\nYou will receive several independent requests below. Answer EACH request "
+		+ "following the rules above and return ONLY a JSON array (no other text) where "
+		+ f"element N-1 is the JSON object answering Request N. There are {len(items)} requests.\n\n"
+		+ "\n\n".join(parts)
+	)
+
+	raw = None
+	for m in list(_GEMINI_MODEL_CANDIDATES):
+		try:
+			raw = _get_chat_model(m).invoke(batch_prompt).content
+		except NotFound:
+			continue
+		break
 
-def _invoke_chain_with_fallback(docs, question: str) -> Optional[dict]:
+	if isinstance(raw, str):
+		try:
+			text = re.sub(r"^```(?:json)?\s*|\s*```$", "", raw.strip())
+			arr = orjson.loads(text)
+			if isinstance(arr, list) and len(arr) == len(items):
+				return [a if isinstance(a, dict) else None for a in arr]
+		except Exception:
+			pass
+
+	# Batch gagal / tidak bisa diparse → fallback per item
+	return [_invoke_chain_with_fallback(context, question) for context, question in items]
+
+
+# Micro-batching /chat: request yang datang berdekatan (window CHAT_BATCH_WINDOW
+# detik, maksimum CHAT_BATCH_MAX item) digabung jadi satu call Gemini; jawaban
+# disebar balik lewat Future per request
+CHAT_BATCH_WINDOW = float(os.environ.get("CHAT_BATCH_WINDOW", 0.02))
+CHAT_BATCH_MAX = 8
+
+_chat_batch_queue = None
+
+
+async def _dispatch_chat_batch(batch):
+	items = [(context, question) for context, question, _ in batch]
 	try:
-		raw = chain.invoke({"context": docs, "question": question})
-	except NotFound:
-		raw = None
-		for m in _GEMINI_MODEL_CANDIDATES:
+		results = await asyncio.to_thread(_invoke_chain_batched, items)
+	except Exception as e:
+		for _, _, fut in batch:
+			if not fut.done():
+				fut.set_exception(e)
+		return
+	for (_, _, fut), result in zip(batch, results):
+		if not fut.done():
+			fut.set_result(result)
+
+
+async def _chat_batch_worker():
+	while True:
+		batch = [await _chat_batch_queue.get()]
+		await asyncio.sleep(CHAT_BATCH_WINDOW)
+		while len(batch) < CHAT_BATCH_MAX:
 			try:
-				tmp_chat = ChatGoogleGenerativeAI(model=m)
-				tmp_chain = (
-					RunnablePassthrough.assign(context=lambda x: format_docs(x["context"]))
-					| rag_prompt
-					| tmp_chat
-					| StrOutputParser()
-				)
-				raw = tmp_chain.invoke({"context": docs, "question": question})
-				os.environ["GEMINI_MODEL"] = m
+				batch.append(_chat_batch_queue.get_nowait())
+			except asyncio.QueueEmpty:
 				break
-			except NotFound:
-				continue
+		# Jangan tunggu panggilan Gemini selesai di sini: dispatch sebagai task
+		# supaya worker langsung kembali menguras queue dan batch bisa overlap
+		asyncio.create_task(_dispatch_chat_batch(batch))
+
 
+@app.on_event("startup")
+async def _start_chat_batcher():
+	global _chat_batch_queue
+	_chat_batch_queue = asyncio.Queue()
+	asyncio.create_task(_chat_batch_worker())
+
+
+def _parse_llm_output(raw) -> Optional[dict]:
 	if raw is None:
 		return None
 
 	if isinstance(raw, str):
 		try:
-			return json.loads(raw)
+			return orjson.loads(raw)
 		except Exception:
 			# Return raw text when JSON parsing fails
 			return {"intent": "qa", "answer": raw, "umkm_list": [], "recommendations": []}
@@ -260,9 +818,31 @@ def _invoke_chain_with_fallback(docs, question: str) -> Optional[dict]:
 
 
 @app.post("/chat")
-def chat_post(body: ChatRequest):
-	# Reload vectorstore setiap kali untuk memastikan data terbaru
-	local_vs = load_faiss_or_none()
+async def chat_post(body: ChatRequest):
+	# Guard murah: input trivial/nonsense tidak perlu menyentuh FAISS/Gemini
+	tokens = re.findall(r"\w+", body.question.lower())
+	if len(tokens) < 2:
+		return {
+			"intent": "qa",
+			"answer": "Pertanyaan terlalu singkat. Coba tulis pertanyaan yang lebih lengkap.",
+			"umkm_list": [],
+			"recommendations": [],
+		}
+
+	# Intent list_umkm dijawab O(1) dari nama hasil ekstraksi saat ingest
+	if _LIST_UMKM_RE.search(body.question.lower()):
+		names = _load_umkm_names()
+		if names:
+			return {
+				"intent": "list_umkm",
+				"answer": "Berikut daftar UMKM yang sudah bergabung.",
+				"umkm_list": sorted(names),
+				"recommendations": [],
+			}
+
+	# Vectorstore di-cache di module level dan di-reload otomatis bila
+	# mtime index.faiss berubah (mis. setelah /admin/upload)
+	local_vs = await asyncio.to_thread(get_vectorstore)
 	if local_vs is None:
 		raise HTTPException(status_code=400, detail="Index is not ready. Upload via /admin/upload first.")
 	
@@ -274,9 +854,20 @@ def chat_post(body: ChatRequest):
 	
 	if num_docs == 0:
 		raise HTTPException(status_code=400, detail="Database kosong. Upload PDF via /admin/upload terlebih dahulu.")
-	
+
+	# Embed pertanyaan SEKALI, lalu pakai vektor yang sama untuk semantic cache
+	# dan FAISS search. Lowercase + rapikan whitespace dulu supaya variasi
+	# penulisan yang sama jatuh ke entri cache/LRU yang sama.
+	norm_question = re.sub(r"\s+", " ", body.question).strip().lower()
+	q_emb = list(await asyncio.to_thread(_embed_query_cached, norm_question))
+	cached = semantic_cache_lookup(q_emb)
+	if cached is not None:
+		return cached
+
 	# Search dengan lebih banyak dokumen untuk memastikan ada hasil
-	docs = local_vs.similarity_search(body.question, k=min(8, num_docs))
+	docs = await asyncio.to_thread(
+		local_vs.similarity_search_by_vector, q_emb, k=min(8, num_docs)
+	)
 	
 	if not docs:
 		return {
@@ -287,10 +878,16 @@ def chat_post(body: ChatRequest):
 			"debug": {"num_docs_in_index": num_docs, "docs_found": 0}
 		}
 	
-	# Debug: log context yang ditemukan (opsional, bisa dihapus di production)
-	context_preview = format_docs(docs[:2])[:200] if docs else ""
-	
-	data = _invoke_chain_with_fallback(docs, body.question)
+	# Join context sekali saja; dipakai untuk preview debug dan semua retry chain
+	context = format_docs(docs)
+	context_preview = context[:200]
+
+	if _chat_batch_queue is not None:
+		fut = asyncio.get_running_loop().create_future()
+		await _chat_batch_queue.put((context, body.question, fut))
+		data = await fut
+	else:
+		data = await asyncio.to_thread(_invoke_chain_with_fallback, context, body.question)
 	if data is None:
 		raise HTTPException(status_code=503, detail="No available Gemini 2.x model for this API key.")
 	
@@ -302,13 +899,17 @@ def chat_post(body: ChatRequest):
 				"docs_found": len(docs),
 				"context_preview": context_preview
 			}
-	
+
+	# Simpan ke semantic cache (jawaban dengan debug info tidak ikut di-cache)
+	if isinstance(data, dict) and "debug" not in data:
+		await asyncio.to_thread(semantic_cache_store, q_emb, data)
+
 	return data
 
 
 @app.get("/chat")
-def chat_get(question: str = Query(..., description="User question")):
-	return chat_post(ChatRequest(question=question))
+async def chat_get(question: str = Query(..., description="User question")):
+	return await chat_post(ChatRequest(question=question))
 
 
 # Run with: uvicorn server:app --host 0.0.0.0 --port 8000